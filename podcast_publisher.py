@@ -1,10 +1,11 @@
 import os
 import datetime
 import subprocess
-import shutil
-import xml.etree.ElementTree as ET
+from lxml import etree as ET
 import csv  # <--- ADDED: Import for CSV handling
-from mutagen.mp3 import MP3
+from concurrent.futures import ThreadPoolExecutor
+from tinytag import TinyTag
+import pygit2
 
 # --- Configuration ---
 # Get the directory where the script is located (this is assumed to be the repo root)
@@ -19,6 +20,9 @@ FEED_FILE = "feed.xml"
 # Name of the topics CSV file
 TOPICS_CSV_FILE = ("C:/Users/jdhou/PycharmProjects/ReportGenerator/Generate Text Scripts/reference files/"
                    "topics.csv")  # <--- ADDED: CSV filename constant
+# Common MP3 filename suffixes; a tuple lets str.endswith() match them without lowercasing each name.
+# Other casings (e.g. '.Mp3') fall back to a case-insensitive check in scan_mp3_files.
+MP3_EXTENSIONS = ('.mp3', '.MP3')
 # Repository details for Git commands
 REPO_NAME = "Private-Podcasts"
 
@@ -34,6 +38,14 @@ ET.register_namespace('itunes', NS_ITUNES)
 NS_ATOM = 'http://www.w3.org/2005/Atom'
 ET.register_namespace('atom', NS_ATOM)
 
+# Namespace-qualified tag names, built once instead of per element
+TAG_ITUNES_DURATION = f"{{{NS_ITUNES}}}duration"
+TAG_ITUNES_AUTHOR = f"{{{NS_ITUNES}}}author"
+TAG_ATOM_LINK = f"{{{NS_ATOM}}}link"
+
+# RFC 822 date format used for <pubDate> and <lastBuildDate> (e.g., Thu, 30 Oct 2025 10:00:00 +0000)
+RFC822_DATE_FORMAT = '%a, %d %b %Y %H:%M:%S +0000'
+
 
 # Helper function to convert seconds to HH:MM:SS format
 def seconds_to_hms(duration):
@@ -49,18 +61,32 @@ def seconds_to_hms(duration):
         return f"{m:02d}:{s:02d}"
 
 
-def get_mp3_metadata(filepath):
+def scan_mp3_files(directory):
+    """
+    Lists the MP3 files in a directory in a single os.scandir() pass.
+    Returns a dictionary mapping filename to its DirEntry, whose stat info is cached.
+    """
+    # The name test runs first; is_file() uses the cached d_type and only stats when the filesystem doesn't report it.
+    # Matching stays case-insensitive: the root listing drives synchronize_feed, so a missed '.Mp3' file would
+    # get its episode deleted from the feed.
+    with os.scandir(directory) as entries:
+        return {entry.name: entry for entry in entries
+                if (entry.name.endswith(MP3_EXTENSIONS) or entry.name[-4:].lower() == '.mp3') and entry.is_file()}
+
+
+def get_mp3_metadata(entry):
     """
-    Reads file size in bytes and duration in seconds/HMS format.
-    Requires: 'mutagen' library
+    Reads file size in bytes and duration in seconds/HMS format from a DirEntry.
+    Requires: 'tinytag' library
     """
+    filepath = entry.path
     try:
-        # File size in bytes
-        file_size = os.path.getsize(filepath)
+        # File size in bytes (DirEntry.stat() reuses the scandir result where possible)
+        file_size = entry.stat().st_size
 
-        # Duration using mutagen
-        audio = MP3(filepath)
-        duration_seconds = audio.info.length
+        # Duration using tinytag; skip tag and image decoding since only the length is needed
+        tag = TinyTag.get(filepath, tags=False, image=False, duration=True)
+        duration_seconds = tag.duration
         duration_hms = seconds_to_hms(duration_seconds)
 
         return file_size, duration_hms
@@ -104,70 +130,135 @@ def load_csv_metadata(csv_path):
         return {}
 
 
-def synchronize_feed(channel):
+def scan_feed_items(feed_path, actual_mp3_files):
+    """
+    Stream-parses the feed and sorts every <channel> <item> by whether its MP3 file is in actual_mp3_files.
+    Returns (existing_guids, missing): the GUIDs of the items that stay in the feed, and the set of
+    enclosure filenames whose MP3 file is missing.
+    Each item is cleared once read, so memory stays flat however large feed.xml grows.
+    """
+    existing_guids = set()
+    missing = set()
+    # The first <channel>, matching root.find('channel'); <item>s anywhere else are ignored
+    channel = None
+
+    for _, elem in ET.iterparse(feed_path, events=('end',), tag='item'):
+        parent = elem.getparent()
+        if channel is None and parent.tag == 'channel':
+            channel = parent
+
+        if parent is channel:
+            # Walk the item's children once rather than calling find() per field
+            guid, url = None, None
+            for child in elem:
+                if child.tag == 'guid':
+                    guid = child.text
+                elif child.tag == 'enclosure':
+                    url = child.get('url')
+
+            # Get the actual filename from the end of the URL
+            filename = os.path.basename(url) if url else None
+
+            if filename and filename not in actual_mp3_files:
+                missing.add(filename)
+            elif guid:
+                existing_guids.add(guid)
+
+        # Free the item and any already-processed siblings
+        elem.clear()
+        while elem.getprevious() is not None:
+            del parent[0]
+
+    return existing_guids, missing
+
+
+def synchronize_feed(channel, missing):
     """
     Synchronizes the feed by removing entries where the corresponding MP3 file
     is missing from the repository root directory (SCRIPT_DIR).
+    missing is the set of enclosure filenames found by scan_feed_items().
+    Returns the number of items removed.
     """
-    print("Starting synchronization: Checking for deleted MP3 files...")
-
-    # 1. Get list of actual MP3 files in the repository root
-    # Note: We check SCRIPT_DIR for files, excluding the upload temp directory name itself
-    actual_mp3_files = {f for f in os.listdir(SCRIPT_DIR) if f.lower().endswith('.mp3') and f != NEW_AUDIO_DIR}
+    if not missing:
+        print("No items needed to be removed from the feed.")
+        return 0
 
+    # Collect first, then remove, so the channel isn't modified while iterating it
     items_to_remove = []
+    for item in channel.iterchildren('item'):
+        enclosure = item.find('enclosure')
+        url = enclosure.get('url') if enclosure is not None else None
+        filename = os.path.basename(url) if url else None
 
-    # 2. Iterate through items in the feed
-    for item in list(channel):
-        if item.tag != 'item':
-            continue
+        if filename in missing:
+            title_el = item.find('title')
+            items_to_remove.append((item, filename, title_el.text if title_el is not None else "Untitled"))
 
-        enclosure = item.find('enclosure')
-        if enclosure is not None:
-            url = enclosure.get('url')
-
-            # 3. Extract the filename from the URL and check existence
-            if url:
-                # Get the actual filename from the end of the URL
-                filename = os.path.basename(url)
-
-                if filename not in actual_mp3_files:
-                    items_to_remove.append(
-                        (item, filename, item.find('title').text if item.find('title') is not None else "Untitled"))
-
-    # 4. Remove missing items from the channel
-    if items_to_remove:
-        for item, filename, title in items_to_remove:
-            channel.remove(item)
-            print(f"Removed item '{title}' from feed.xml (MP3 file '{filename}' is missing).")
-        return True
-    else:
-        print("No items needed to be removed from the feed.")
-        return False
+    for item, filename, title in items_to_remove:
+        channel.remove(item)
+        print(f"Removed item '{title}' from feed.xml (MP3 file '{filename}' is missing).")
+    return len(items_to_remove)
 
 
 def update_podcast_feed():
     """
     Main function to process new audio files, update feed.xml, and prepare for Git.
+    Returns the number of changes made to the feed (0 means there is nothing to commit).
     """
+    # Format the run timestamp once in RFC 822 format; it is shared by every new <pubDate> and <lastBuildDate>
+    run_timestamp = datetime.datetime.now(datetime.timezone.utc).strftime(RFC822_DATE_FORMAT)
+
     # Check the upload directory using the absolute path
     if not os.path.exists(NEW_AUDIO_FULL_PATH):
         os.makedirs(NEW_AUDIO_FULL_PATH)
         print(f"Created directory '{NEW_AUDIO_DIR}'. Place MP3s inside it and run again.")
-        return False
+        return 0
 
-    # List files from the correct path
-    new_files = [f for f in os.listdir(NEW_AUDIO_FULL_PATH) if f.lower().endswith('.mp3')]
+    # List files from the correct path, keeping each DirEntry for its cached stat info
+    new_files = scan_mp3_files(NEW_AUDIO_FULL_PATH)
+    # Get list of actual MP3 files in the repository root (used for sync and to avoid overwriting files)
+    actual_mp3_files = scan_mp3_files(SCRIPT_DIR)
 
     # --- ADDED: Load topic data from CSV ---
     topic_metadata = load_csv_metadata(TOPICS_CSV_FULL_PATH)
 
     # Check for feed file existence using the absolute path
-    if not os.path.exists(FEED_FILE_FULL_PATH):
+    feed_created = not os.path.exists(FEED_FILE_FULL_PATH)
+    if feed_created:
+        existing_guids, missing = set(), set()
+    else:
+        # --- STEP 1: Find deleted files ---
+        # Stream the feed items once; the full tree is only built below if the feed has to change.
+        # existing_guids excludes the missing items, so deleted episodes can be re-added.
+        print("Starting synchronization: Checking for deleted MP3 files...")
+        existing_guids, missing = scan_feed_items(FEED_FILE_FULL_PATH, actual_mp3_files)
+
+    # Drop uploads that would be skipped anyway before reading any metadata or loading the tree
+    pending_files = {}
+    for filename, entry in new_files.items():
+        if filename in actual_mp3_files:
+            print(f"Skipping '{filename}': a file with this name already exists in the repository root.")
+            continue
+
+        # Use filename prefix as a unique GUID (e.g., '104_British_...' -> '104')
+        guid = filename.partition('_')[0]
+        if guid in existing_guids:
+            print(f"Skipping '{filename}': GUID '{guid}' already exists in feed.xml.")
+            continue
+
+        pending_files[filename] = (entry, guid)
+
+    if not (feed_created or missing or pending_files):
+        print("No items needed to be removed from the feed.")
+        print(f"\nNo changes to '{FEED_FILE}'. Nothing to save.")
+        return 0
+
+    if feed_created:
         # If feed.xml doesn't exist, create a basic one. Synchronization skipped.
         print(f"'{FEED_FILE}' not found. Creating a minimal new feed structure.")
 
-        root = ET.Element('rss', attrib={'version': '2.0', 'xmlns:itunes': NS_ITUNES, 'xmlns:atom': NS_ATOM})
+        # Declare the namespaces once on the root so child elements don't re-declare them
+        root = ET.Element('rss', attrib={'version': '2.0'}, nsmap={'itunes': NS_ITUNES, 'atom': NS_ATOM})
         channel = ET.SubElement(root, 'channel')
 
         # Add basic channel metadata (user should ideally customize these manually later)
@@ -177,46 +268,61 @@ def update_podcast_feed():
         ET.SubElement(channel, 'language').text = "en-us"
 
         # Add atom:link for self-reference
-        atom_link = ET.SubElement(channel, f"{{{NS_ATOM}}}link",
+        atom_link = ET.SubElement(channel, TAG_ATOM_LINK,
                                   attrib={'href': f"{BASE_URL}{FEED_FILE}", 'rel': 'self',
                                           'type': 'application/rss+xml'})
 
         tree = ET.ElementTree(root)  # Initialize tree for later saving
+        removed = 0
     else:
         # Load existing XML structure using the absolute path
-        tree = ET.parse(FEED_FILE_FULL_PATH)
+        # Drop the existing indentation so lxml can re-indent consistently on save
+        tree = ET.parse(FEED_FILE_FULL_PATH, ET.XMLParser(remove_blank_text=True))
         root = tree.getroot()
         channel = root.find('channel')
 
         if channel is None:
             print(f"Error: '{FEED_FILE}' is missing the required '<channel>' tag.")
-            return False
+            return 0
 
-        # --- STEP 1: Synchronize Feed (Remove deleted files) ---
-        synchronize_feed(channel)
+        # --- STEP 1b: Synchronize Feed (Remove deleted files) ---
+        removed = synchronize_feed(channel, missing)
 
     # --- STEP 2: Add New Files ---
     episodes_added = 0
 
-    # Re-scan existing GUIDs after synchronization, to prevent adding items
-    # that were already present and not deleted.
-    existing_guids = {item.find('guid').text for item in channel.findall('item') if item.find('guid') is not None}
+    # Remove old lastBuildDate if it exists (a fresh one is added on save), so the positions below stay valid
+    old_date = channel.find('lastBuildDate')
+    if old_date is not None:
+        channel.remove(old_date)
+
+    # Find the 'language' tag and the first <item> in one pass over the channel metadata.
+    # Each new item is inserted at first_item_idx so it ends up first; language stays ahead of it.
+    language_idx = None
+    first_item_idx = len(channel)
+    for i, child in enumerate(channel):
+        if child.tag == 'item':
+            first_item_idx = i
+            break
+        if child.tag == 'language':
+            language_idx = i
+
+    # --- Metadata Extraction ---
+    # Probing files is I/O-bound, so read them concurrently; the loop below only edits the XML and moves files
+    metadata = {}
+    if pending_files:
+        with ThreadPoolExecutor(max_workers=min(8, len(pending_files))) as executor:
+            metadata = dict(zip(pending_files,
+                                executor.map(get_mp3_metadata, (entry for entry, _ in pending_files.values()))))
 
-    for filename in new_files:
+    for filename, (entry, guid) in pending_files.items():
         # Use the absolute path for the source file
-        local_path = os.path.join(NEW_AUDIO_FULL_PATH, filename)
+        local_path = entry.path
 
-        # --- Metadata Extraction ---
-        file_size, duration_hms = get_mp3_metadata(local_path)
+        file_size, duration_hms = metadata[filename]
         if file_size is None:
             continue
 
-        # Use filename prefix as a unique GUID (e.g., '104_British_...' -> '104')
-        guid = filename.split('_')[0]
-        if guid in existing_guids:
-            print(f"Skipping '{filename}': GUID '{guid}' already exists in feed.xml.")
-            continue
-
         # --- MODIFIED: Lookup title and description from CSV metadata ---
         topic_data = topic_metadata.get(guid)
 
@@ -232,14 +338,15 @@ def update_podcast_feed():
             description = f"Automated upload for: {title}"
             print(f"ID {guid} not found in CSV. Using default title/description.")
 
-        # Set publish date to now in RFC 822 format (e.g., Thu, 30 Oct 2025 10:00:00 +0000)
-        pub_date = datetime.datetime.now(datetime.timezone.utc).strftime('%a, %d %b %Y %H:%M:%S +0000')
-
         # --- Create XML Item ---
         item = ET.Element('item')
 
+        # Insert the new item at the top of the channel (newest episode first).
+        # Attaching it before adding children lets the iTunes tags reuse the root's namespace declaration.
+        channel.insert(first_item_idx, item)
+
         ET.SubElement(item, 'title').text = title  # Uses looked-up title
-        ET.SubElement(item, 'pubDate').text = pub_date
+        ET.SubElement(item, 'pubDate').text = run_timestamp
         ET.SubElement(item, 'description').text = description  # Uses looked-up description
 
         # Add GUID
@@ -251,90 +358,95 @@ def update_podcast_feed():
                       attrib={'url': enclosure_url, 'length': str(file_size), 'type': 'audio/mpeg'})
 
         # Add iTunes Duration
-        ET.SubElement(item, f"{{{NS_ITUNES}}}duration").text = duration_hms
-        ET.SubElement(item, f"{{{NS_ITUNES}}}author").text = "My Name"  # Set your preferred author name
-
-        # Insert the new item at the top of the channel (newest episode first)
-        first_item = channel.find('item')
-        if first_item is not None:
-            channel.insert(list(channel).index(first_item), item)
-        else:
-            channel.append(item)
+        ET.SubElement(item, TAG_ITUNES_DURATION).text = duration_hms
+        ET.SubElement(item, TAG_ITUNES_AUTHOR).text = "My Name"  # Set your preferred author name
 
         episodes_added += 1
 
         # --- Move File to Repository Root ---
         # Destination path uses the SCRIPT_DIR (the repository root)
         dest_path = os.path.join(SCRIPT_DIR, filename)
-        shutil.move(local_path, dest_path)
+        # The upload directory lives inside the repository root, so this is a same-filesystem rename
+        os.replace(local_path, dest_path)
         print(f"Processed and moved: {filename}")
 
     # --- STEP 3: Final Save ---
-
-    # Remove old lastBuildDate if it exists
-    old_date = channel.find('lastBuildDate')
-    if old_date is not None:
-        channel.remove(old_date)
+    # A freshly created feed still needs writing even if no episodes were added
+    changes = episodes_added + removed + int(feed_created)
+    if not changes:
+        print(f"\nNo changes to '{FEED_FILE}'. Nothing to save.")
+        return 0
 
     # Update last build date and insert at the top
     last_build_date = ET.Element('lastBuildDate')
-    last_build_date.text = datetime.datetime.now(datetime.timezone.utc).strftime('%a, %d %b %Y %H:%M:%S +0000')
+    last_build_date.text = run_timestamp
 
-    # Find the position of 'language' tag to insert lastBuildDate after it
-    language_tag = channel.find('language')
-    if language_tag is not None:
-        channel.insert(list(channel).index(language_tag) + 1, last_build_date)
+    # Insert lastBuildDate after the 'language' tag located above
+    if language_idx is not None:
+        channel.insert(language_idx + 1, last_build_date)
     else:
         channel.append(last_build_date)
 
     # 4. Save the updated XML using the absolute path
-    # Prettify the XML (optional but nice)
-    from xml.dom import minidom
-    xml_string = ET.tostring(root, encoding='utf-8')
-    pretty_xml = minidom.parseString(xml_string).toprettyxml(indent="  ")
-
-    # Clean up empty lines created by minidom
-    with open(FEED_FILE_FULL_PATH, "w", encoding="utf-8") as f:
-        # Write only non-empty lines from prettified XML
-        for line in pretty_xml.split('\n'):
-            if line.strip():
-                f.write(line + '\n')
+    # lxml pretty-prints in a single pass while serializing
+    tree.write(FEED_FILE_FULL_PATH, pretty_print=True, xml_declaration=True, encoding='utf-8')
 
     print(f"\nSuccessfully updated '{FEED_FILE}' with {episodes_added} new episodes.")
-    return True
+    return changes
 
 
 def run_git_commands():
     """
-        Executes git add, commit, and push commands.
-        Explicitly sets the current working directory (cwd) to the SCRIPT_DIR
-        to ensure Git runs within the repository root.
+        Stages and commits all changes in-process with pygit2 (libgit2), then pushes.
+        The repository is opened at SCRIPT_DIR to ensure Git runs within the repository root.
+        The push still uses the git command so it picks up the configured credential helper.
+        Requires: 'pygit2' library
         """
     try:
         print("\n--- Running Git Commands ---")
+        repo = pygit2.Repository(SCRIPT_DIR)
+        index = repo.index
 
         # 1. Stage all changes (new files, moved files, updated feed.xml, deleted files)
-        # Use cwd=SCRIPT_DIR
-        subprocess.run(['git', 'add', '-A'], check=True, capture_output=True, text=True, cwd=SCRIPT_DIR)
+        # A single status scan gives everything 'git add -A' would stage
+        for path, flags in repo.status().items():
+            if flags & pygit2.GIT_STATUS_WT_DELETED:
+                index.remove(path)
+            elif flags & (pygit2.GIT_STATUS_WT_NEW | pygit2.GIT_STATUS_WT_MODIFIED | pygit2.GIT_STATUS_WT_TYPECHANGE):
+                index.add(path)
+        index.write()
         print("Git: Staged all changes, including removals.")
 
         # 2. Commit
+        tree = index.write_tree()
+        parents = [] if repo.head_is_unborn else [repo.head.target]
+        if parents and repo.head.peel(pygit2.Tree).id == tree:
+            print("Git: Nothing to commit.")
+            return
+
         commit_message = f"Automated podcast update: Synced feed, added new episodes."
-        # Use cwd=SCRIPT_DIR
-        subprocess.run(['git', 'commit', '-m', commit_message], check=True, capture_output=True, text=True,
-                       cwd=SCRIPT_DIR)
+        # Author and committer come from the user's Git config (user.name / user.email)
+        signature = repo.default_signature
+        repo.create_commit('HEAD', signature, signature, commit_message, tree, parents)
         print("Git: Committed changes.")
 
         # 3. Push
         print("Git: Pushing to remote...")
-        # Use cwd=SCRIPT_DIR
-        subprocess.run(['git', 'push', 'origin', 'main'], check=True, capture_output=True, text=True, cwd=SCRIPT_DIR)
+        # Use -C SCRIPT_DIR; GIT_OPTIONAL_LOCKS=0 skips optional index lock/refresh work.
+        # Only stderr is captured (for error reporting), stdout is discarded rather than buffered.
+        git_env = {**os.environ, 'GIT_OPTIONAL_LOCKS': '0'}
+        subprocess.run(['git', '-C', SCRIPT_DIR, 'push', 'origin', 'main'], check=True, env=git_env,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
         print("Git: Successfully pushed changes to GitHub!")
 
     except subprocess.CalledProcessError as e:
         print("\n--- GIT ERROR ---")
         print("Failed to execute Git commands. Please check your Git setup (authentication, current branch).")
         print(f"Error output: {e.stderr}")
+    except pygit2.GitError as e:
+        print("\n--- GIT ERROR ---")
+        print("Failed to stage or commit changes. Please check your Git setup (user.name/user.email, repository).")
+        print(f"Error output: {e}")
     except FileNotFoundError:
         print("\n--- GIT ERROR ---")
         print("The 'git' command was not found. Please ensure Git is installed and in your system's PATH.")
@@ -346,5 +458,5 @@ if __name__ == "__main__":
 
     # 1. Update the XML and move files
     if update_podcast_feed():
-        # 2. Commit and push the changes
+        # 2. Commit and push the changes (skipped when the feed was left untouched)
         run_git_commands()
\ No newline at end of file
@@ -124,7 +124,8 @@ def update_podcast_feed():
         # If feed.xml doesn't exist, create a basic one. Synchronization skipped.
         print(f"'{FEED_FILE}' not found. Creating a minimal new feed structure.")
 
-        root = ET.Element('rss', attrib={'version': '2.0', 'xmlns:itunes': NS_ITUNES, 'xmlns:atom': NS_ATOM})
+        # The registered namespaces add the xmlns declarations on write; declaring them here too duplicates them
+        root = ET.Element('rss', attrib={'version': '2.0'})
         channel = ET.SubElement(root, 'channel')
 
         # Add basic channel metadata (user should ideally customize these manually later)
@@ -233,17 +234,9 @@ def update_podcast_feed():
         channel.append(last_build_date)
 
     # 4. Save the updated XML using the absolute path
-    # Prettify the XML (optional but nice)
-    from xml.dom import minidom
-    xml_string = ET.tostring(root, encoding='utf-8')
-    pretty_xml = minidom.parseString(xml_string).toprettyxml(indent="  ")
-
-    # Clean up empty lines created by minidom
-    with open(FEED_FILE_FULL_PATH, "w", encoding="utf-8") as f:
-        # Write only non-empty lines from prettified XML
-        for line in pretty_xml.split('\n'):
-            if line.strip():
-                f.write(line + '\n')
+    # Prettify the XML in place (Python 3.9+), no minidom round-trip needed
+    ET.indent(tree, space="  ")
+    tree.write(FEED_FILE_FULL_PATH, encoding='utf-8', xml_declaration=True)
 
     print(f"\nSuccessfully updated '{FEED_FILE}' with {episodes_added} new episodes.")
     return True